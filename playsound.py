@@ -1,6 +1,9 @@
 class PlaysoundException(Exception):
     pass
 
+#music_index used to look up the length of sounds, see set_music_index
+_index = None
+
 def _playsoundWin(sound, block = True):
     '''
     Utilizes windll.winmm. Tested and known to work with MP3 and WAVE on
@@ -33,8 +36,14 @@ def _playsoundWin(sound, block = True):
     alias = 'playsound_' + str(random())
     winCommand('open "' + sound + '" alias', alias)
     winCommand('set', alias, 'time format milliseconds')
-    durationInMS = winCommand('status', alias, 'length')
-    winCommand('play', alias, 'from 0 to', durationInMS.decode())
+    durationInMS = None
+    if _index is not None:
+        durationInMS = _index.lookup(sound)
+    if durationInMS is None:
+        durationInMS = int(winCommand('status', alias, 'length'))
+        if _index is not None:
+            _index.store(sound, durationInMS)
+    winCommand('play', alias, 'from 0 to', str(durationInMS))
 
     if block:
         sleep(float(durationInMS) / 1000.0)
@@ -126,7 +135,7 @@ del system
 
 from ctypes import c_buffer, windll
 from random import random
-from time   import sleep
+from time   import sleep,perf_counter
 from sys    import getfilesystemencoding
 def winCommand(*command):
     buf = c_buffer(255)
@@ -143,9 +152,141 @@ def winCommand(*command):
 
 
 
-from threading import Thread,Event,Lock
-from queue import Queue,Empty
+def _query_length(sound):
+    '''
+        open sound with a temporary alias and return its length in milliseconds
+    '''
+    alias='playsound_'+str(random())
+    winCommand('open "'+sound+'" alias',alias)
+    try:
+        winCommand('set',alias,'time format milliseconds')
+        return int(winCommand('status',alias,'length').decode())
+    finally:
+        winCommand('close',alias)
+
+
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread,Event,Lock,Condition,current_thread
 from collections import deque
+from struct import Struct
+import wave
+
+'''
+    persistent index of the length of sounds, keyed by path, size and mtime,
+    so that sounds need not be opened only to ask for their length
+'''
+class music_index(object):
+    __path=None
+    __entries=None
+    __mutex=None
+    def __init__(self,path=None):
+        '''
+            load the index from the json file path if it exists,
+            if path is None the index only lives in memory
+        '''
+        self.__path=path
+        self.__entries={}
+        self.__mutex=Lock()
+        if path is not None and os.path.isfile(path):
+            with open(path,'r') as f:
+                self.__entries=json.load(f)
+
+    def lookup(self,sound):
+        '''
+            return the indexed length of sound in milliseconds, or None if sound is not indexed
+            or has changed since it was indexed
+        '''
+        key=self.__key(sound)
+        if key is None:
+            return None
+        path,size,mtime=key
+        entry=self.__entries.get(path)
+        if entry is not None and entry[0]==size and entry[1]==mtime:
+            return entry[2]
+        return None
+
+    def store(self,sound,length):
+        '''
+            index the length of sound in milliseconds, e.g. read from an alias which is already open
+        '''
+        key=self.__key(sound)
+        if key is None:
+            return
+        path,size,mtime=key
+        self.__mutex.acquire()
+        self.__entries[path]=[size,mtime,length]
+        self.__mutex.release()
+
+    def length(self,sound):
+        '''
+            return the length of sound in milliseconds, opening the sound only if it is not indexed yet
+        '''
+        length=self.lookup(sound)
+        if length is None:
+            length=_query_length(sound)
+            self.store(sound,length)
+        return length
+
+    def scan(self,directory,extensions=('.mp3','.wav','.wma','.mid'),workers=4):
+        '''
+            index every sound below directory whose extension is in extensions,
+            using workers threads, and return the number of indexed sounds.
+            sounds which cannot be opened are skipped
+        '''
+        sounds=[]
+        for root,dirs,files in os.walk(directory):
+            for name in files:
+                if name.lower().endswith(extensions):
+                    sounds.append(os.path.join(root,name))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(executor.map(self.__try_index,sounds))
+
+    def save(self,path=None):
+        '''
+            write the index to the json file path, by default the file it was loaded from
+        '''
+        if path is None:
+            path=self.__path
+        if path is None:
+            raise PlaysoundException('No path given to save the music index')
+        #write a temporary file and swap it in, so an interrupted save never leaves a broken index
+        tmp=path+'.tmp'
+        self.__mutex.acquire()
+        try:
+            with open(tmp,'w') as f:
+                json.dump(self.__entries,f)
+            os.replace(tmp,path)
+        finally:
+            self.__mutex.release()
+
+    def __try_index(self,sound):
+        try:
+            self.length(sound)
+            return 1
+        except PlaysoundException:
+            return 0
+
+    def __key(self,sound):
+        if '://' in sound:
+            return None
+        try:
+            st=os.stat(sound)
+        except OSError:
+            return None
+        return os.path.abspath(sound),st.st_size,st.st_mtime
+
+
+def set_music_index(index):
+    '''
+        make playsound and music players read the length of sounds from index,
+        None restores asking the sound itself
+    '''
+    global _index
+    _index=index
+
 
 '''
     music class which uses windows mci to play the music
@@ -157,6 +298,7 @@ class _music(object):
     __sound=None
     __start=None
     __end=None
+    __total_length=None
     __is_repeat=False
     __id=-1
     music_list=None
@@ -251,8 +393,14 @@ class _music(object):
             winCommand('open "'+self.__sound+'" alias',self.__alias[i])
             winCommand('set',self.__alias[i],'time format milliseconds')
         
-        
-        length=self.total_length()
+        self.__total_length=None
+        if _index is not None:
+            self.__total_length=_index.lookup(self.__sound)
+        if self.__total_length is None:
+            self.__total_length=int(winCommand('status',self.__alias[0],'length').decode())
+            if _index is not None:
+                _index.store(self.__sound,self.__total_length)
+        length=self.__total_length
         self.__start=0
         self.__end=length
         return length
@@ -315,22 +463,27 @@ class _music(object):
     '''
     def total_length(self):
         if self.__check_alias():
-            return int(winCommand('status',self.__get_alias(),'length').decode())
+            return self.__total_length
     
 
     '''
-        update the record time of the music, 
+        update the record time of the music, return the mode and the position,
+        position is only queried while playing if the music repeats or need_position is True,
+        otherwise it is None
     '''
-    def update_mode(self,delay=0):
+    def update_mode(self,delay=0,need_position=False):
         mod = self.mode()
+        pos = None
 
         if mod =='playing':
-                #if self.__end-self.position()<delay then repeat the music
+                if self.__is_repeat==True or need_position:
+                    pos = self.position()
+                #if self.__end-pos<delay then repeat the music
                 if self.__is_repeat==True:
-                    if self.__end-self.position()<=delay:
+                    if self.__end-pos<=delay:
                         self.__running_idx=(self.__running_idx+1)%2
                         self.__play_implement(self.__start,self.__end)
-        return mod
+        return mod,pos
        
         
     
@@ -373,6 +526,7 @@ class _music(object):
             self.__alias=['','']
             self.__start=None
             self.__end=None
+            self.__total_length=None
             self.__is_repeat=False
 
     def __play_implement(self,start,end):
@@ -420,6 +574,10 @@ class _music_tag(object):
     block=False
     retval=None         #return value for some methods of music player
     music_list=None     #special deal with music list
+    put_time=None       #perf_counter when the tag is pushed to music manager
+    done_time=None      #perf_counter when music manager has executed the tag
+    from_manager=False  #whether music manager sent the tag itself, e.g. music_list.play_next
+    merged=None         #tags coalesced into this one, they are done when this one is
     def __init__(self,id,operator,block=False,*args):
         self.id=id
         self.operator = operator
@@ -495,7 +653,11 @@ class music_player(object):
         music_player.static_id=music_player.static_id+1
         self.mutex.release()
 
-        self.__send('open',False,self.__music,self.__id)
+        try:
+            self.__send('open',False,self.__music,self.__id)
+        except:
+            self.__id=-1
+            raise
 
     
     def pause(self):
@@ -527,6 +689,16 @@ class music_player(object):
         '''
         self.__send('resume',False)
 
+    def status(self):
+        '''
+            get (mode,position) of music as last seen by music manager, or None if it has not been seen yet.
+
+            unlike mode and position, this method sends no tag and never blocks, so it suits polling from timers
+        '''
+        if self.__id==-1:
+            raise PlaysoundException('No music has been opened')
+        return music_manager.GetInstance().snapshot(self.__id)
+
     
     def seek(self,pos):
         '''
@@ -570,6 +742,71 @@ class music_player(object):
         return music_manager.GetInstance().put_tag(tag)
 
 
+def render_wav(sounds,path,block_frames=65536):
+    '''
+        render sounds one after another into the WAVE file path, as music_list would play them,
+        without playing them in real time. every item of sounds is either the name of a WAVE file
+        or a tuple (sound,start,end) in milliseconds where end=-1 means the end of sound.
+        all sounds must share channels, sample width and frame rate.
+        sounds are copied block_frames frames at a time so memory use does not grow with their length.
+        the file is rendered next to path and only moved to path once complete.
+
+        return the length of the rendered file in milliseconds
+    '''
+    tmp=path+'.tmp'
+    out=None
+    params=None
+    frames=0
+    rendered=False
+    try:
+        for item in sounds:
+            if isinstance(item,tuple):
+                sound,start,end=item
+            else:
+                sound,start,end=item,0,-1
+            src=wave.open(sound,'rb')
+            try:
+                p=(src.getnchannels(),src.getsampwidth(),src.getframerate())
+                if params is None:
+                    params=p
+                    out=wave.open(tmp,'wb')
+                    out.setnchannels(p[0])
+                    out.setsampwidth(p[1])
+                    out.setframerate(p[2])
+                elif p!=params:
+                    raise PlaysoundException('format of '+sound+' differs from the previous sounds')
+
+                rate=p[2]
+                total=src.getnframes()
+                first=start*rate//1000
+                last=total if end==-1 else min(total,end*rate//1000)
+                if first<0 or first>last:
+                    raise PlaysoundException('music range exceed limits')
+                src.setpos(first)
+                remaining=last-first
+                while remaining>0:
+                    data=src.readframes(min(block_frames,remaining))
+                    if not data:
+                        break
+                    out.writeframes(data)
+                    remaining-=len(data)//(p[0]*p[1])
+                frames+=last-first-remaining
+            finally:
+                src.close()
+        if params is None:
+            raise PlaysoundException('No sound to render')
+        out.close()
+        out=None
+        os.replace(tmp,path)
+        rendered=True
+    finally:
+        if out is not None:
+            out.close()
+        if not rendered and os.path.exists(tmp):
+            os.remove(tmp)
+    return frames*1000//params[2]
+
+
 class music_list(object):
     __music_list=deque()
     def append_music(self,sound,repeat=False):
@@ -602,12 +839,54 @@ class music_list(object):
     def top(self):
         return self.__music_list[0]
 
+    def render(self,path):
+        '''
+            render the musics of the list into the WAVE file path instead of playing them,
+            repeating musics are rendered once
+        '''
+        #music manager may pop the list in play_next while it is rendered
+        return render_wav([m.get_music() for m in list(self.__music_list)],path)
+
+
+'''
+    record of a trace file: timestamp, id, block, length of operator, length of args encoded as utf-8 json
+'''
+_trace_record=Struct('<di?BH')
+
+def _read_trace(path):
+    '''
+        yield (timestamp,id,operator,block,args) for every record of a trace file
+    '''
+    with open(path,'rb') as f:
+        while True:
+            head=f.read(_trace_record.size)
+            if len(head)<_trace_record.size:
+                break
+            timestamp,id,block,op_len,args_len=_trace_record.unpack(head)
+            operator=f.read(op_len).decode('ascii')
+            args=tuple(json.loads(f.read(args_len).decode('utf-8')))
+            yield timestamp,id,operator,block,args
+
 
 class music_manager(_singleton):
     __mutex=Lock()
     __sounds=[]
     # __music_list=[]
-    __tag_queue=Queue()
+    __tag_queue=deque()
+    __tag_condition=Condition()
+    __pending_tags={}       #id -> last tag of this id which is still in __tag_queue
+    __max_tags=0            #capacity of __tag_queue, 0 means unbounded
+    __queue_policy='block'  #what put_tag does when __tag_queue is full
+    __manager_thread=None
+    __coalesced_operators=('seek','set_repeat')
+    __snapshots={}          #id -> (mode,position) last seen by music manager, read without lock
+    __stale_snapshots=set() #ids whose position was moved by a tag since their last snapshot
+    __trace_mutex=Lock()
+    __trace_file=None
+    __trace_start=None
+    __loop_passes=0         #passes of the main loop
+    __loop_poll_time=0.0    #seconds the main loop spent polling the musics
+    __loop_poll_max=0.0     #longest poll of the musics in seconds
     __running_event=Event()
     __end_running_event=Event()
 
@@ -626,39 +905,128 @@ class music_manager(_singleton):
         '''
         if tag.block:
             tag.block_event.clear()
-        self.__tag_queue.put(tag)
+        tag.put_time=perf_counter()
+        tag.from_manager=current_thread() is self.__manager_thread
+        self.__tag_condition.acquire()
+        try:
+            #only the latest value matters for these operators, so if the last pending tag of
+            #the same music has the same operator, update it instead of queueing a new one
+            pending=self.__pending_tags.get(tag.id)
+            if (not tag.block and tag.operator in self.__coalesced_operators
+                    and pending is not None and pending.operator==tag.operator):
+                pending.args=tag.args
+                if pending.merged is None:
+                    pending.merged=[]
+                pending.merged.append(tag)
+            else:
+                #music manager itself sends tags, e.g. music_list.play_next, it must never wait for itself
+                while (self.__max_tags>0 and len(self.__tag_queue)>=self.__max_tags
+                        and not tag.from_manager):
+                    if self.__queue_policy=='fail':
+                        #a music player must not be left believing an unopened music is open
+                        if tag.operator in ('open','close'):
+                            break
+                        raise PlaysoundException('music manager queue is full')
+                    elif self.__queue_policy=='block' or not self.__drop_oldest_tag():
+                        self.__tag_condition.wait()
+
+                self.__tag_queue.append(tag)
+                self.__pending_tags[tag.id]=tag
+                self.__tag_condition.notify_all()
+        finally:
+            self.__tag_condition.release()
+
+        #only tags accepted by music manager are recorded
+        if self.__trace_file is not None:
+            self.__record_tag(tag)
+
         if tag.block:
             tag.block_event.wait()
             
         return tag.retval
 
-    def get_tag(self):
+    def get_tag(self,timeout=None):
+        self.__tag_condition.acquire()
         try:
             #if there is no task for music player, then sleep the music manager,
-            #otherwise get a tag immediately
+            #otherwise wait at most timeout seconds for a tag so that the main loop
+            #keeps polling the musics without spinning on the queue
             if len(self.__sounds)>0:
-                tag=self.__tag_queue.get_nowait()
-            else:
-                tag=self.__tag_queue.get()
-            retval=None
-            if tag.operator == 'open':
-                m=self.__add_music(*tag.args)
-                m.set_music_list(tag.music_list)
-            elif tag.operator == 'close':
-                #remove the music from self.__sounds
-                self.__rm_music(tag.id)
+                if len(self.__tag_queue)==0:
+                    self.__tag_condition.wait(timeout)
             else:
-                (idx,item)=self.__get_music_idx_and_item(tag.id)
-                #reflect
-                retval=getattr(item,tag.operator)(*tag.args)
-            
-            #set return values in tag
-            if tag.block==True:
-                tag.retval=retval
-                tag.block_event.set()
-        except Empty:
-            pass
+                while len(self.__tag_queue)==0:
+                    self.__tag_condition.wait()
+            if len(self.__tag_queue)==0:
+                return
+            tag=self.__pop_tag()
+        finally:
+            self.__tag_condition.release()
+
+        retval=None
+        if tag.operator == 'open':
+            m=self.__add_music(*tag.args)
+            m.set_music_list(tag.music_list)
+        elif tag.operator == 'close':
+            #remove the music from self.__sounds
+            self.__rm_music(tag.id)
+        else:
+            (idx,item)=self.__get_music_idx_and_item(tag.id)
+            #reflect
+            retval=getattr(item,tag.operator)(*tag.args)
+            if tag.operator in ('play','pause','resume','seek','stop'):
+                self.__stale_snapshots.add(tag.id)
+        
+        tag.retval=retval
+        self.__release_tag(tag)
+
+    def __pop_tag(self):
+        '''
+            remove the oldest tag from the queue, the caller must hold __tag_condition
+        '''
+        tag=self.__tag_queue.popleft()
+        if self.__pending_tags.get(tag.id) is tag:
+            del self.__pending_tags[tag.id]
+        self.__tag_condition.notify_all()
+        return tag
+
+    def __drop_oldest_tag(self):
+        '''
+            discard the oldest tag which neither opens nor closes a music nor was sent by
+            music manager itself, return False if there is none. the caller must hold __tag_condition
+        '''
+        for tag in self.__tag_queue:
+            if tag.operator not in ('open','close') and not tag.from_manager:
+                self.__tag_queue.remove(tag)
+                if self.__pending_tags.get(tag.id) is tag:
+                    del self.__pending_tags[tag.id]
+                self.__release_tag(tag)
+                return True
+        return False
+
+    def __release_tag(self,tag):
+        tag.done_time=perf_counter()
+        if tag.merged is not None:
+            for merged in tag.merged:
+                merged.done_time=tag.done_time
+        #wake up the thread waiting for the return value
+        if tag.block==True:
+            tag.block_event.set()
+
     
+    def __record_tag(self,tag):
+        op=tag.operator.encode('ascii')
+        args=json.dumps(tag.args).encode('utf-8')
+        self.__trace_mutex.acquire()
+        try:
+            if self.__trace_file is not None:
+                self.__trace_file.write(_trace_record.pack(tag.put_time-self.__trace_start,
+                    tag.id,tag.block,len(op),len(args)))
+                self.__trace_file.write(op)
+                self.__trace_file.write(args)
+        finally:
+            self.__trace_mutex.release()
+
     def __add_music(self,sound,id): 
         m=_music(sound,id)
         self.__mutex.acquire()
@@ -671,10 +1039,19 @@ class music_manager(_singleton):
         idx,rm_item=self.__get_music_idx_and_item(id)
         rm_item.close()
         rm_item.set_id(-1)
+        self.__snapshots.pop(id,None)
+        self.__stale_snapshots.discard(id)
         self.__mutex.acquire()
         self.__sounds.pop(idx)
         self.__mutex.release()
 
+    def snapshot(self,id):
+        '''
+            return (mode,position) of the music id as last seen by music manager,
+            or None if music manager has not seen it yet. it does not wait for music manager
+        '''
+        return self.__snapshots.get(id)
+
     def __get_music_idx_and_item(self,id):
         for i,x in enumerate(self.__sounds):
             if x.get_id()==id:
@@ -694,6 +1071,126 @@ class music_manager(_singleton):
 
     
 
+    @classmethod
+    def set_queue_policy(cls,max_tags=0,policy='block'):
+        '''
+            bound the music tag queue to max_tags tags (0 means unbounded) and choose
+            what put_tag does when it is full:
+                'block'       wait until music manager takes a tag
+                'drop_oldest' discard the oldest queued tag except open and close, its sender gets None
+                'fail'        raise PlaysoundException, except for open and close which are queued anyway
+        '''
+        if policy not in ('block','drop_oldest','fail'):
+            raise PlaysoundException('Unknown queue policy: '+str(policy))
+        if max_tags<0:
+            raise PlaysoundException('max_tags must not be negative')
+        manager = cls.GetInstance()
+        manager.__tag_condition.acquire()
+        music_manager.__max_tags=max_tags
+        music_manager.__queue_policy=policy
+        manager.__tag_condition.notify_all()
+        manager.__tag_condition.release()
+
+    @classmethod
+    def start_trace(cls,path):
+        '''
+            record every music tag pushed to the music manager into the binary trace file path
+        '''
+        manager = cls.GetInstance()
+        manager.__trace_mutex.acquire()
+        try:
+            if manager.__trace_file is not None:
+                raise PlaysoundException('music manager is already recording a trace')
+            music_manager.__trace_file=open(path,'wb')
+            music_manager.__trace_start=perf_counter()
+        finally:
+            manager.__trace_mutex.release()
+
+    @classmethod
+    def stop_trace(cls):
+        '''
+            stop recording music tags and close the trace file
+        '''
+        manager = cls.GetInstance()
+        manager.__trace_mutex.acquire()
+        try:
+            if manager.__trace_file is not None:
+                manager.__trace_file.close()
+                music_manager.__trace_file=None
+        finally:
+            manager.__trace_mutex.release()
+
+    @classmethod
+    def replay_trace(cls,path,speed=1.0,timeout=60.0):
+        '''
+            feed the music tags of a trace file to the music manager, speed times faster than
+            they were recorded (speed<=0 feeds them as fast as possible), and return
+            a dict with the count, mean, max and 95th percentile of the queue latency in seconds,
+            and the passes of the main loop with the mean and max seconds it spent polling the musics
+            during the replay.
+
+            ids of the trace are remapped to fresh ids, so replaying does not disturb opened music players.
+            tags of musics whose open is not in the trace are skipped, and musics still open
+            at the end of the trace are closed. blocking tags are replayed without blocking.
+            raise PlaysoundException if music manager has not executed the replayed tags
+            timeout seconds after the last one was fed.
+        '''
+        records=list(_read_trace(path))
+
+        #reserve a range of ids for the replayed musics
+        music_player.mutex.acquire()
+        base=music_player.static_id
+        music_player.static_id=base+max([r[1] for r in records]+[-1])+1
+        music_player.mutex.release()
+
+        manager = cls.GetInstance()
+        tags=[]
+        opened=set()
+        passes=manager.__loop_passes
+        poll_time=manager.__loop_poll_time
+        music_manager.__loop_poll_max=0.0
+        start=perf_counter()
+        for timestamp,id,operator,block,args in records:
+            #music manager would raise for a music it never opened
+            if operator=='open':
+                opened.add(id)
+                args=(args[0],base+args[1])
+            elif id not in opened:
+                continue
+            elif operator=='close':
+                opened.discard(id)
+            if speed>0:
+                wait=start+timestamp/speed-perf_counter()
+                if wait>0:
+                    sleep(wait)
+            tag=_music_tag(base+id,operator,False,*args)
+            manager.put_tag(tag)
+            tags.append(tag)
+        for id in opened:
+            tag=_music_tag(base+id,'close',False)
+            manager.put_tag(tag)
+            tags.append(tag)
+
+        #wait until music manager has executed all the replayed tags
+        deadline=perf_counter()+timeout
+        for tag in tags:
+            while tag.done_time is None:
+                if perf_counter()>deadline:
+                    raise PlaysoundException('music manager did not execute the replayed tags in time')
+                sleep(0.001)
+
+        latency=sorted(t.done_time-t.put_time for t in tags) or [0.0]
+        passes=manager.__loop_passes-passes
+        return {
+            'count':len(tags),
+            'mean':sum(latency)/len(latency),
+            'max':latency[-1],
+            'p95':latency[min(len(latency)-1,int(len(latency)*0.95))],
+            'passes':passes,
+            'poll_mean':(manager.__loop_poll_time-poll_time)/passes if passes>0 else 0.0,
+            'poll_max':manager.__loop_poll_max,
+        }
+
     @classmethod
     def stop(cls):
         '''
@@ -712,22 +1209,50 @@ class music_manager(_singleton):
     @classmethod
     def _start_music_manager_impl(cls):
         manager = cls.GetInstance()
+        music_manager.__manager_thread=current_thread()
         print('start manager',manager)
         delay=100
+        #seconds the manager waits for a tag between two polls of the musics,
+        #it must stay well below delay so that repeat and play_next are not late
+        poll_interval=delay/10000.0
+        #snapshots are published every snapshot_passes passes instead of every pass
+        snapshot_passes=5
+        passes=0
         
         
         while(manager.__running_event.isSet()):
+            publish = passes%snapshot_passes==0
+            passes+=1
+            poll_start=perf_counter()
             for m in manager.__sounds:
-                mode = m.update_mode(delay)
+                id = m.get_id()
+                in_list = m.music_list!=None and not m.is_repeat()
+                mode,pos = m.update_mode(delay,in_list or publish)
+
+                #publish mode and position, position only moves while playing or by a tag
+                if publish:
+                    last = manager.__snapshots.get(id)
+                    if pos is None:
+                        if last is None or last[0]!=mode or id in manager.__stale_snapshots:
+                            pos = m.position()
+                        else:
+                            pos = last[1]
+                    manager.__stale_snapshots.discard(id)
+                    manager.__snapshots[id]=(mode,pos)
 
                 #callback the music_list
-                if m.music_list!=None and mode=='playing' and not m.is_repeat():
-                    pos = m.position()
+                if in_list and mode=='playing':
                     total_length=m.total_length()
                     if  total_length-pos<=delay:
                         m.music_list.play_next()            
 
-            manager.get_tag()
+            poll=perf_counter()-poll_start
+            music_manager.__loop_passes=passes
+            music_manager.__loop_poll_time+=poll
+            if poll>manager.__loop_poll_max:
+                music_manager.__loop_poll_max=poll
+
+            manager.get_tag(poll_interval)
             
             
         for x in manager.__sounds: